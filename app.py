@@ -1,12 +1,65 @@
 import streamlit as st
 from streamlit.components.v1 import html
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 from datetime import datetime
 import os
 from feedback_manager import ensure_file_exists
 import time
 
+# Base URL of the sentiment API (or of the load balancer in front of a pool of API instances)
+API_BASE_URL = os.environ.get("SENTIMENT_API_URL", "http://localhost:8000").rstrip("/")
+# (connect, read) timeouts in seconds
+API_TIMEOUT = (3.05, 30)
+ANALYSIS_CACHE_SIZE = 64
+
+@st.cache_resource
+def get_http_session():
+    # Shared across reruns and sessions so connections are kept alive and pooled
+    session = requests.Session()
+    # Only connection failures and 503 (no upstream available, request not forwarded) are retried:
+    # a slow read or a gateway timeout means inference may still be running and must not be re-run.
+    # raise_on_status=False hands the final response to raise_for_status() so errors show their status code
+    retries = Retry(connect=3, read=0, status=3, backoff_factor=0.3, status_forcelist=[503], allowed_methods=["GET", "POST"], raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def analyze_text(text):
+    # Per-session result cache: re-analysing the same text makes no new API call
+    cache = st.session_state.setdefault("analysis_cache", {})
+    if text in cache:
+        return cache[text]
+    response = get_http_session().post(f"{API_BASE_URL}/analyze/", json={"sentence": text}, timeout=API_TIMEOUT)
+    response.raise_for_status()
+    result = response.json()
+    if len(cache) >= ANALYSIS_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+    cache[text] = result
+    return result
+
+positive_sentiment_words = ["High Positive", "Medium Positive", "Low Positive"]
+negative_sentiment_words = ["High Negative", "Medium Negative", "Low Negative"]
+neutral_sentiment_words = ["High Neutral", "Medium Neutral", "Low Neutral"]
+
+def render_highlights(highlights, sentiment):
+    if sentiment in positive_sentiment_words:
+        rgb = "0, 200, 0"
+    elif sentiment in negative_sentiment_words:
+        rgb = "200, 0, 0"
+    elif sentiment in neutral_sentiment_words:
+        rgb = "128, 128, 128"
+    else:
+        rgb = "180, 180, 180"
+    highlighted = []
+    for h in highlights:
+        imp = float(h["importance"])
+        highlighted.append(f'<span style="background-color:rgba({rgb}, {imp});padding:2px 4px;border-radius:4px">{h["word"]} <span style="font-size:0.9em;color:#333;opacity:0.7;">({imp:.2f})</span></span>')
+    return " ".join(highlighted)
+
 # --- Landing Section State ---
 if "landing_shown" not in st.session_state:
     st.session_state["landing_shown"] = True
@@ -195,76 +248,55 @@ if st.session_state.stage == 0:
     if analyze_button and st.session_state["input_text"].strip():
         with st.spinner("Analyzing..."):
             try:
-                response = requests.post("http://localhost:8000/analyze/", json={"sentence": st.session_state["input_text"]})
-                if response.status_code == 200:
-                    result = response.json()
-                    score = result["score"]
-                    score = score * 4
-                    highlights = result["highlights"]
-                    # Only keep the latest highlights
-                    st.session_state["last_highlights"] = highlights
-                    if "editable_highlights" in st.session_state:
-                        del st.session_state["editable_highlights"]
-                    # New: Multi-level sentiment classification
-                    if score >= 8.0:
-                        sentiment = "High Positive"
-                        sentiment_color = "#21bf21"
-                    elif score >= 7.0:
-                        sentiment = "Medium Positive"
-                        sentiment_color = "#4be04b"
-                    elif score >= 6.0:
-                        sentiment = "Low Positive"
-                        sentiment_color = "#8ff78f"
-                    elif score >= 5.0:
-                        sentiment = "High Neutral"
-                        sentiment_color = "#ffdc00"
-                    elif score >= 4.5:
-                        sentiment = "Medium Neutral"
-                        sentiment_color = "#ffe066"
-                    elif score >= 4.0:
-                        sentiment = "Low Neutral"
-                        sentiment_color = "#fff3b0"
-                    elif score >= 3.0:
-                        sentiment = "Low Negative"
-                        sentiment_color = "#ffb3b3"
-                    elif score >= 2.5:
-                        sentiment = "Medium Negative"
-                        sentiment_color = "#ff6666"
-                    else:
-                        sentiment = "High Negative"
-                        sentiment_color = "#c00000"
-                    st.session_state["last_user_input"] = st.session_state["input_text"]
-                    st.session_state["last_sentiment"] = sentiment
-                    st.session_state["last_score"] = score
-                    st.session_state["last_highlights"] = highlights
-                    st.markdown(f"**Sentiment Score:** {score}")
-                    st.markdown(f'<span style="font-size:1.3em;font-weight:bold;color:{sentiment_color}">{sentiment}</span>', unsafe_allow_html=True)
-                    st.markdown("**Word Importance:**")
-                    highlighted = []
-                    positive_sentiment_words = ["High Positive", "Medium Positive", "Low Positive"]
-                    negative_sentiment_words = ["High Negative", "Medium Negative", "Low Negative"]
-                    neutral_sentiment_words = ["High Neutral", "Medium Neutral", "Low Neutral"]
-                    for h in highlights:
-                        imp = float(h["importance"])
-                        if sentiment in positive_sentiment_words:
-                            color = f"rgba(0, 200, 0, {imp})"
-                        elif sentiment in negative_sentiment_words:
-                            color = f"rgba(200, 0, 0, {imp})"
-                        elif sentiment in neutral_sentiment_words:
-                            color = f"rgba(128, 128, 128, {imp})"
-                        else:
-                            color = f"rgba(180, 180, 180, {imp})"
-                        highlighted.append(f'<span style="background-color:{color};padding:2px 4px;border-radius:4px">{h["word"]} <span style="font-size:0.9em;color:#333;opacity:0.7;">({imp:.2f})</span></span>')
-                    st.markdown(" ".join(highlighted), unsafe_allow_html=True)
-                    st.session_state["last_user_input"] = st.session_state["input_text"]
-                    st.session_state["last_sentiment"] = sentiment
-                    st.session_state["last_score"] = score
-                    st.session_state["last_highlights"] = highlights
-                    with feedback_container:
-                        if st.button("What's wrong?",on_click=set_stage, args=[1], key="feedback_btn"):
-                            st.session_state["actual_score"] = score
+                result = analyze_text(st.session_state["input_text"])
+                score = result["score"]
+                score = score * 4
+                highlights = result["highlights"]
+                if "editable_highlights" in st.session_state:
+                    del st.session_state["editable_highlights"]
+                # New: Multi-level sentiment classification
+                if score >= 8.0:
+                    sentiment = "High Positive"
+                    sentiment_color = "#21bf21"
+                elif score >= 7.0:
+                    sentiment = "Medium Positive"
+                    sentiment_color = "#4be04b"
+                elif score >= 6.0:
+                    sentiment = "Low Positive"
+                    sentiment_color = "#8ff78f"
+                elif score >= 5.0:
+                    sentiment = "High Neutral"
+                    sentiment_color = "#ffdc00"
+                elif score >= 4.5:
+                    sentiment = "Medium Neutral"
+                    sentiment_color = "#ffe066"
+                elif score >= 4.0:
+                    sentiment = "Low Neutral"
+                    sentiment_color = "#fff3b0"
+                elif score >= 3.0:
+                    sentiment = "Low Negative"
+                    sentiment_color = "#ffb3b3"
+                elif score >= 2.5:
+                    sentiment = "Medium Negative"
+                    sentiment_color = "#ff6666"
                 else:
-                    st.error(f"API Error: {response.status_code} - {response.text}")
+                    sentiment = "High Negative"
+                    sentiment_color = "#c00000"
+                # Only keep the latest result; the highlight HTML is rendered once and reused in the feedback stage
+                st.session_state["last_user_input"] = st.session_state["input_text"]
+                st.session_state["last_sentiment"] = sentiment
+                st.session_state["last_score"] = score
+                st.session_state["last_highlights"] = highlights
+                st.session_state["last_highlights_html"] = render_highlights(highlights, sentiment)
+                st.markdown(f"**Sentiment Score:** {score}")
+                st.markdown(f'<span style="font-size:1.3em;font-weight:bold;color:{sentiment_color}">{sentiment}</span>', unsafe_allow_html=True)
+                st.markdown("**Word Importance:**")
+                st.markdown(st.session_state["last_highlights_html"], unsafe_allow_html=True)
+                with feedback_container:
+                    if st.button("What's wrong?",on_click=set_stage, args=[1], key="feedback_btn"):
+                        st.session_state["actual_score"] = score
+            except requests.HTTPError as e:
+                st.error(f"API Error: {e.response.status_code} - {e.response.text}")
             except Exception as e:
                 st.error(f"Request failed: {e}")
     elif not st.session_state["input_text"].strip():
@@ -273,12 +305,8 @@ if st.session_state.stage == 0:
 if st.session_state.stage == 1:
     with feedback_container:
         with result_container:
-            positive_sentiment_words = ["High Positive", "Medium Positive", "Low Positive"]
-            negative_sentiment_words = ["High Negative", "Medium Negative", "Low Negative"]
-            neutral_sentiment_words = ["High Neutral", "Medium Neutral", "Low Neutral"]
             score = st.session_state["last_score"]
             sentiment = st.session_state["last_sentiment"]
-            highlights = st.session_state["last_highlights"]
             if sentiment in positive_sentiment_words:
                 sentiment_color = "#21bf21"
             elif sentiment in negative_sentiment_words:
@@ -288,20 +316,7 @@ if st.session_state.stage == 1:
             st.markdown(f"**Sentiment Score:** {score}")
             st.markdown(f'<span style="font-size:1.3em;font-weight:bold;color:{sentiment_color}">{sentiment}</span>', unsafe_allow_html=True)
             st.markdown("**Word Importance:**")
-            
-            highlighted = []
-            for h in highlights:
-                imp = float(h["importance"])
-                if sentiment in positive_sentiment_words:
-                    color = f"rgba(0, 200, 0, {imp})"
-                elif sentiment in negative_sentiment_words:
-                    color = f"rgba(200, 0, 0, {imp})"
-                elif sentiment in neutral_sentiment_words:
-                    color = f"rgba(128, 128, 128, {imp})"
-                else:
-                    color = f"rgba(180, 180, 180, {imp})"
-                highlighted.append(f'<span style="background-color:{color};padding:2px 4px;border-radius:4px">{h["word"]} <span style="font-size:0.9em;color:#333;opacity:0.7;">({imp:.2f})</span></span>')
-            st.markdown(" ".join(highlighted), unsafe_allow_html=True)
+            st.markdown(st.session_state["last_highlights_html"], unsafe_allow_html=True)
       
         st.markdown("**If the sentiment is wrong, please provide the actual sentiment score below (0 = extremely negative, 10 = extremely positive):**")
         sentiment_options = [
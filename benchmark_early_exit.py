@@ -0,0 +1,68 @@
+import time
+import numpy as np
+from sentiment_api import tokenizer, tokenize_batch, model, run_model, early_exit_heads, EARLY_EXIT_HEADS_PATH
+from train_sentiment_with_importance import ReviewDataset
+
+# Compares early-exit inference against full-depth inference on the same texts:
+# average number of encoder layers executed, score drift and latency.
+
+WARMUP_INPUTS = 8
+
+def load_texts(data_path, limit):
+    # Read the data exactly the way training does
+    texts = [sample["text"] for sample in ReviewDataset(data_path, tokenizer).samples]
+    return texts[:limit] if limit else texts
+
+
+def time_pass(encoded, threshold):
+    # threshold None means full-depth inference
+    start = time.perf_counter()
+    results = [run_model(model_inputs, early_exit=threshold is not None, confidence_threshold=threshold) for model_inputs in encoded]
+    return (time.perf_counter() - start) / len(encoded), results
+
+
+def benchmark(texts, thresholds, repeats):
+    num_layers = model.config.num_hidden_layers
+    encoded = [entry["model_inputs"] for entry in tokenize_batch(texts)]
+    configs = [None] + list(thresholds)
+
+    # Untimed warm-up of both paths so one-time costs are not charged to whichever pass runs first
+    for threshold in configs:
+        time_pass(encoded[:WARMUP_INPUTS], threshold)
+
+    # Repeat every pass, alternating the order, and report the median latency
+    timings = {threshold: [] for threshold in configs}
+    results = {}
+    for repeat in range(repeats):
+        for threshold in (configs if repeat % 2 == 0 else configs[::-1]):
+            avg_time, outputs = time_pass(encoded, threshold)
+            timings[threshold].append(avg_time)
+            results.setdefault(threshold, outputs)
+
+    full_time = np.median(timings[None])
+    full_scores = np.array([score for score, _, _ in results[None]])
+    print(f"Full depth      | Avg layers: {num_layers:5.2f} | Avg latency: {full_time*1000:7.2f} ms")
+
+    for threshold in thresholds:
+        avg_time = np.median(timings[threshold])
+        scores = np.array([score for score, _, _ in results[threshold]])
+        layers = np.array([exit_layer for _, _, exit_layer in results[threshold]])
+        drift = np.abs(scores - full_scores)
+        print(
+            f"Threshold {threshold:.2f} | Avg layers: {layers.mean():5.2f} | Avg latency: {avg_time*1000:7.2f} ms"
+            f" | Speedup: {full_time/avg_time:4.2f}x | Mean drift: {drift.mean():.3f} | Max drift: {drift.max():.3f}"
+            f" | Early exits: {np.mean(layers < num_layers)*100:5.1f}%"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", type=str, required=True, help="Path to evaluation data (JSONL or CSV)")
+    parser.add_argument("--limit", type=int, default=500, help="Maximum number of texts to benchmark (0 for all)")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.7, 0.8, 0.9, 0.95, 0.99], help="Confidence thresholds to evaluate")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed passes per configuration, run in alternating order")
+    args = parser.parse_args()
+    if early_exit_heads is None:
+        raise SystemExit(f"No early-exit heads loaded from {EARLY_EXIT_HEADS_PATH}; train them with --mode early_exit first.")
+    benchmark(load_texts(args.data, args.limit), args.thresholds, args.repeats)
@@ -0,0 +1,139 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+HEADS_FILENAME = "early_exit_heads.pt"
+
+# Lightweight classifier heads on top of intermediate encoder layers.
+# Head i reads the [CLS] hidden state after encoder layer i+1 and predicts the
+# same label distribution as the final classifier, so inference can stop as soon
+# as one of them is confident enough.
+class EarlyExitHeads(nn.Module):
+    def __init__(self, num_layers, hidden_size, num_labels, base_model=None, dropout=0.1):
+        super().__init__()
+        # Exits are driven by softmax confidence, which is meaningless for a single regression output
+        if num_labels < 2:
+            raise ValueError("Early exit requires a classification model with at least 2 labels; regression models are not supported")
+        self.base_model = base_model
+        self.num_layers = num_layers
+        self.hidden_size = hidden_size
+        self.num_labels = num_labels
+        # No head after the last layer: the model's own classifier handles that one
+        self.heads = nn.ModuleList([
+            nn.Sequential(nn.Dropout(dropout), nn.Linear(hidden_size, num_labels))
+            for _ in range(num_layers - 1)
+        ])
+
+    def forward(self, layer_idx, hidden_state):
+        # layer_idx is 0-based: the head for the output of encoder layer layer_idx+1
+        return self.heads[layer_idx](hidden_state[:, 0])
+
+
+def save_heads(heads, path):
+    torch.save({
+        "base_model": heads.base_model,
+        "num_layers": heads.num_layers,
+        "hidden_size": heads.hidden_size,
+        "num_labels": heads.num_labels,
+        "state_dict": heads.state_dict(),
+    }, path)
+
+
+def load_heads(path, map_location="cpu"):
+    checkpoint = torch.load(path, map_location=map_location)
+    heads = EarlyExitHeads(checkpoint["num_layers"], checkpoint["hidden_size"], checkpoint["num_labels"], base_model=checkpoint.get("base_model"))
+    heads.load_state_dict(checkpoint["state_dict"])
+    heads.eval()
+    return heads
+
+
+def check_heads_match(heads, model_name, config):
+    # Heads trained for a different model would silently produce scores on the wrong label scale
+    expected = {
+        "base_model": model_name,
+        "num_layers": config.num_hidden_layers,
+        "hidden_size": config.hidden_size,
+        "num_labels": config.num_labels,
+    }
+    mismatches = [
+        f"{key}: heads have {getattr(heads, key)!r}, served model has {value!r}"
+        for key, value in expected.items() if getattr(heads, key) != value
+    ]
+    if mismatches:
+        raise ValueError("Early-exit heads do not match the served model (" + "; ".join(mismatches) + ")")
+
+
+def distillation_loss(model_outputs, heads):
+    """
+    Self-distillation loss for the early-exit heads.
+
+    Every intermediate head is trained to match the softmax of the full-depth
+    classifier, which keeps the early-exit scores close to full-depth scores.
+
+    Args:
+        model_outputs: Outputs of the frozen model run with output_hidden_states=True
+        heads: EarlyExitHeads being trained
+
+    Returns:
+        Mean KL divergence across all intermediate heads
+    """
+    teacher = F.softmax(model_outputs.logits.detach(), dim=-1)
+    # hidden_states[0] is the embedding output, hidden_states[i] the output of layer i
+    hidden_states = model_outputs.hidden_states
+    loss = 0.0
+    for layer_idx in range(heads.num_layers - 1):
+        student = F.log_softmax(heads(layer_idx, hidden_states[layer_idx + 1].detach()), dim=-1)
+        loss = loss + F.kl_div(student, teacher, reduction="batchmean")
+    return loss / (heads.num_layers - 1)
+
+
+def _classify_final(model, base, hidden_state):
+    # Reproduce the model's own classification head on the last hidden state
+    pooler = getattr(base, "pooler", None)
+    if pooler is not None:
+        pooled = pooler(hidden_state)
+        if hasattr(model, "dropout"):
+            pooled = model.dropout(pooled)
+        return model.classifier(pooled)
+    return model.classifier(hidden_state)
+
+
+def early_exit_forward(model, heads, model_inputs, threshold):
+    """
+    Run the encoder layer by layer and stop once a head is confident enough.
+
+    Args:
+        model: Sequence classification model (BERT-style encoder)
+        heads: EarlyExitHeads trained for this model
+        model_inputs: Tokenizer outputs for a single sentence (without offset_mapping)
+        threshold: Minimum max-softmax probability required to exit early
+
+    Returns:
+        Tuple of (logits, attentions of the executed layers, 1-based exit layer)
+    """
+    base = getattr(model, model.base_model_prefix)
+    input_ids = model_inputs["input_ids"]
+    attention_mask = model_inputs.get("attention_mask")
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+    extended_mask = base.get_extended_attention_mask(attention_mask, input_ids.shape)
+
+    hidden_state = base.embeddings(input_ids=input_ids, token_type_ids=model_inputs.get("token_type_ids"))
+    layers = base.encoder.layer
+    attentions = []
+    for layer_idx, layer in enumerate(layers):
+        layer_outputs = layer(hidden_state, attention_mask=extended_mask, output_attentions=True)
+        # Relies on the (hidden_state, attentions, ...) tuple returned by BertLayer-style modules;
+        # fail clearly if a transformers release changes that instead of indexing the batch dimension
+        if not isinstance(layer_outputs, tuple) or len(layer_outputs) < 2 or layer_outputs[0].dim() != 3 or layer_outputs[1] is None or layer_outputs[1].dim() != 4:
+            raise RuntimeError("Unexpected encoder layer outputs; early exit is not supported by this transformers version")
+        hidden_state = layer_outputs[0]
+        attentions.append(layer_outputs[1])
+        if layer_idx == len(layers) - 1:
+            break
+        logits = heads(layer_idx, hidden_state)
+        confidence = F.softmax(logits, dim=-1).max().item()
+        if confidence >= threshold:
+            return logits, tuple(attentions), layer_idx + 1
+
+    return _classify_final(model, base, hidden_state), tuple(attentions), len(layers)
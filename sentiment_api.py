@@ -1,10 +1,17 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
-from typing import List, Dict
+from typing import List, Dict, Optional
+from collections import OrderedDict
 import numpy as np
+import logging
+import os
 import re
+import threading
+from early_exit import load_heads, check_heads_match, early_exit_forward, HEADS_FILENAME
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Sentiment Analysis API", description="API for sentiment regression and word highlighting.")
 
@@ -17,28 +24,57 @@ model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
 tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
 model.eval()
 
+# Optional early-exit heads, produced by `train_sentiment_with_importance.py --mode early_exit`
+EARLY_EXIT_HEADS_PATH = os.environ.get("EARLY_EXIT_HEADS_PATH", HEADS_FILENAME)
+EARLY_EXIT_THRESHOLD = float(os.environ.get("EARLY_EXIT_THRESHOLD", "0.9"))
+early_exit_heads = load_heads(EARLY_EXIT_HEADS_PATH) if os.path.exists(EARLY_EXIT_HEADS_PATH) else None
+if early_exit_heads is not None:
+    # Early exit is optional: mismatched heads disable it instead of taking down /analyze/
+    try:
+        check_heads_match(early_exit_heads, MODEL_NAME, model.config)
+    except ValueError as e:
+        logger.error(f"Early exit disabled: {e}")
+        early_exit_heads = None
+
 class SentimentRequest(BaseModel):
     sentence: str
+    early_exit: bool = False
+    confidence_threshold: Optional[float] = Field(None, gt=0, le=1)
 
 class SentimentResponse(BaseModel):
     score: float
     highlights: List[Dict[str, str]]
+    exit_layer: int
 
-# The model will calculate word importance dynamically based on attention weights
+# Upper bound on sentences per /analyze_batch/ request, so one request cannot hog a worker or flush the tokenization cache
+MAX_BATCH_SIZE = 64
+
+class BatchSentimentRequest(BaseModel):
+    sentences: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+    early_exit: bool = False
+    confidence_threshold: Optional[float] = Field(None, gt=0, le=1)
 
-def calculate_word_importance(sentence, attention_weights, tokens, offsets):
+# Bounded LRU cache of tokenization results keyed by the exact sentence text
+TOKENIZATION_CACHE_SIZE = int(os.environ.get("TOKENIZATION_CACHE_SIZE", "4096"))
+_tokenization_cache = OrderedDict()
+_tokenization_cache_lock = threading.Lock()
+
+def _build_tokenization(sentence, encoding):
     """
-    Calculate importance scores for each word in the sentence based on attention weights.
-    
+    Precompute everything the request path needs from a single tokenized sentence.
+
     Args:
         sentence: The input sentence
-        attention_weights: Attention weights from the transformer model
-        tokens: Tokenized words
-        offsets: Token offsets for mapping back to original text
-    
+        encoding: Fast tokenizer output for the sentence (lists, with offset_mapping)
+
     Returns:
-        Dictionary mapping words to their importance scores
+        Dictionary with model input tensors, token offsets, the regex word spans with
+        their token indices (used for importance), and the whitespace-separated words
+        with the indices of the word spans they contain (used for highlights)
     """
+    offsets = [tuple(offset) for offset in encoding["offset_mapping"]]
+    num_tokens = len(offsets)
+
     # Create a mapping from character positions to tokens
     char_to_token = {}
     for i, (start, end) in enumerate(offsets):
@@ -46,122 +82,164 @@ def calculate_word_importance(sentence, attention_weights, tokens, offsets):
             continue
         for char_idx in range(start, end):
             char_to_token[char_idx] = i
-    
-    # Extract words and their positions
-    word_importances = {}
-    word_positions = []
-    
-    # Use regex to find word boundaries with their positions
+
+    # Use regex to find word boundaries and the tokens that are part of each word
+    word_spans = []
     for match in re.finditer(r'\b\w+\b', sentence):
-        word = match.group().lower()
         start, end = match.span()
-        word_positions.append((word, start, end))
+        token_indices = sorted({char_to_token[c] for c in range(start, end) if c in char_to_token})
+        # Skip special tokens
+        token_indices = [t for t in token_indices if t < num_tokens - 2]  # Accounting for special tokens
+        word_spans.append((start, end, token_indices))
+
+    # Map each whitespace-separated word to the word spans inside its character range,
+    # so "great!" gets the importance of "great"
+    words = []
+    span_idx = 0
+    for match in re.finditer(r'\S+', sentence):
+        start, end = match.span()
+        contained = []
+        while span_idx < len(word_spans) and word_spans[span_idx][0] < end:
+            if word_spans[span_idx][0] >= start:
+                contained.append(span_idx)
+            span_idx += 1
+        words.append((match.group(), contained))
+
+    return {
+        "model_inputs": {k: torch.tensor([v]) for k, v in encoding.items() if k != "offset_mapping"},
+        "offsets": offsets,
+        "word_spans": word_spans,
+        "words": words,
+    }
+
+def tokenize_batch(sentences):
+    """
+    Return cached tokenization results for the sentences, encoding all cache misses
+    in a single call to the fast tokenizer's batch API.
+    """
+    results = {}
+    with _tokenization_cache_lock:
+        for sentence in sentences:
+            if sentence in _tokenization_cache:
+                _tokenization_cache.move_to_end(sentence)
+                results[sentence] = _tokenization_cache[sentence]
+    misses = list(dict.fromkeys(s for s in sentences if s not in results))
+    if misses:
+        batch = tokenizer(misses, return_offsets_mapping=True, truncation=True)
+        built = [_build_tokenization(sentence, {k: batch[k][i] for k in batch.keys()}) for i, sentence in enumerate(misses)]
+        with _tokenization_cache_lock:
+            for sentence, entry in zip(misses, built):
+                results[sentence] = entry
+                _tokenization_cache[sentence] = entry
+                _tokenization_cache.move_to_end(sentence)
+            while len(_tokenization_cache) > TOKENIZATION_CACHE_SIZE:
+                _tokenization_cache.popitem(last=False)
+    return [results[sentence] for sentence in sentences]
+
+# The model will calculate word importance dynamically based on attention weights
+
+def calculate_word_importance(attention_weights, word_spans):
+    """
+    Calculate importance scores for each word in the sentence based on attention weights.
     
-    # Calculate importance for each word based on attention
-    for word, start, end in word_positions:
-        # Find all tokens that are part of this word
-        token_indices = []
-        for char_idx in range(start, end):
-            if char_idx in char_to_token:
-                token_indices.append(char_to_token[char_idx])
-        
-        # Remove duplicates and sort
-        token_indices = sorted(set(token_indices))
-        
-        if not token_indices:  # Skip if no tokens found for this word
-            continue
-        
-        # Calculate importance based on attention weights for these tokens
-        # Use the average attention weight across all layers and heads
-        importance = 0.0
-        count = 0
-        
-        for token_idx in token_indices:
-            # Skip special tokens
-            if token_idx >= len(tokens) - 2:  # Accounting for special tokens
-                continue
-                
-            # Get attention for this token (average across all layers and heads)
-            token_attention = attention_weights[:, :, token_idx].mean().item()
-            importance += token_attention
-            count += 1
-        
-        if count > 0:
-            importance /= count
-            word_importances[word] = importance
+    Args:
+        attention_weights: Attention weights from the transformer model
+        word_spans: Word spans with the indices of their tokens, from the tokenization cache
+    
+    Returns:
+        List of importance scores aligned with word_spans (None for words without tokens)
+    """
+    # Attention received by each token, averaged across all heads and query positions
+    token_attention = attention_weights.mean(dim=(0, 1)).tolist()
+
+    # Calculate importance for each word as the average attention of its tokens
+    word_importances = [
+        sum(token_attention[t] for t in token_indices) / len(token_indices) if token_indices else None
+        for _, _, token_indices in word_spans
+    ]
+    scored = [imp for imp in word_importances if imp is not None]
     
     # Normalize importance scores to range [0.1, 1.0]
-    if word_importances:
-        min_imp = min(word_importances.values())
-        max_imp = max(word_importances.values())
+    if scored:
+        min_imp = min(scored)
+        max_imp = max(scored)
         
-        # Avoid division by zero
-        if max_imp > min_imp:
-            for word in word_importances:
+        for i, imp in enumerate(word_importances):
+            if imp is None:
+                continue
+            # Avoid division by zero
+            if max_imp > min_imp:
                 # Normalize to [0.1, 1.0] range
-                word_importances[word] = 0.1 + 0.9 * (word_importances[word] - min_imp) / (max_imp - min_imp)
-        else:
-            # If all words have the same importance, set to mid-range
-            for word in word_importances:
-                word_importances[word] = 0.5
+                word_importances[i] = 0.1 + 0.9 * (imp - min_imp) / (max_imp - min_imp)
+            else:
+                # If all words have the same importance, set to mid-range
+                word_importances[i] = 0.5
     
     return word_importances
 
-@app.post("/analyze/", response_model=SentimentResponse)
-def analyze_sentiment(request: SentimentRequest):
-    sentence = request.sentence
-    inputs = tokenizer(sentence, return_tensors="pt", return_offsets_mapping=True, truncation=True)
-    # Remove 'offset_mapping' from model inputs if present
-    model_inputs = {k: v for k, v in inputs.items() if k != "offset_mapping"}
-    
+def logits_to_score(logits):
+    # For regression: scale output to 0-10 if needed
+    if logits.shape[-1] == 1:
+        score = logits.item()
+        return max(0.0, min(10.0, score))
+    # For classification: use softmax and weighted average
+    probs = torch.nn.functional.softmax(logits, dim=-1).squeeze()
+    score = float((probs * torch.arange(len(probs))).sum().item())
+    return score * (10.0 / (len(probs)-1))  # scale to 0-10
+
+def run_model(model_inputs, early_exit=False, confidence_threshold=None):
+    """
+    Run the model on tokenized inputs, optionally exiting at an intermediate layer.
+
+    Returns:
+        Tuple of (score, attentions, 1-based index of the layer that produced the score)
+    """
+    if early_exit and early_exit_heads is None:
+        raise HTTPException(status_code=503, detail=f"Early exit requested but no early-exit heads are loaded ({EARLY_EXIT_HEADS_PATH})")
     with torch.no_grad():
-        outputs = model(**model_inputs, output_attentions=True)
-        
-        # Extract logits for sentiment score calculation
-        if hasattr(outputs, "logits"):
-            logits = outputs.logits
+        if early_exit:
+            threshold = EARLY_EXIT_THRESHOLD if confidence_threshold is None else confidence_threshold
+            logits, attentions, exit_layer = early_exit_forward(model, early_exit_heads, model_inputs, threshold)
         else:
-            logits = outputs[0]
-            
-        # Extract attention weights
-        attentions = outputs.attentions
-        
-        # For regression: scale output to 0-10 if needed
-        if logits.shape[-1] == 1:
-            score = logits.item()
-            score = max(0.0, min(10.0, score))
-        else:
-            # For classification: use softmax and weighted average
-            probs = torch.nn.functional.softmax(logits, dim=-1).squeeze()
-            score = float((probs * torch.arange(len(probs))).sum().item())
-            score = score * (10.0 / (len(probs)-1))  # scale to 0-10
+            outputs = model(**model_inputs, output_attentions=True)
+
+            # Extract logits for sentiment score calculation
+            if hasattr(outputs, "logits"):
+                logits = outputs.logits
+            else:
+                logits = outputs[0]
+
+            # Extract attention weights
+            attentions = outputs.attentions
+            exit_layer = model.config.num_hidden_layers
+
+        score = logits_to_score(logits)
+    return score, attentions, exit_layer
+
+def analyze_tokenized(sentence, tokenized, early_exit=False, confidence_threshold=None):
+    score, attentions, exit_layer = run_model(tokenized["model_inputs"], early_exit, confidence_threshold)
     
-    # Process attention weights - average across all layers and heads
+    # Process attention weights - average across all executed layers and heads
     # Shape: [layers, heads, seq_len, seq_len]
     avg_attention = torch.mean(torch.stack(attentions), dim=0)  # Average across layers
     avg_attention = torch.mean(avg_attention, dim=0)  # Average across heads
     
-    # Get tokens and their offsets
-    tokens = tokenizer.convert_ids_to_tokens(inputs["input_ids"][0])
-    offsets = inputs["offset_mapping"][0].tolist()
-    
     # Calculate word importance scores
-    word_importances = calculate_word_importance(sentence, avg_attention, tokens, offsets)
+    word_importances = calculate_word_importance(avg_attention, tokenized["word_spans"])
     
-    # Extract words from the sentence by splitting on whitespace
-    words = [w for w in sentence.split() if w.strip()]
     highlights = []
     
-    # Process each word in the original sentence
-    for word in words:
-        # Get importance score for this word, default to 0.5 if not found
-        importance = word_importances.get(word.lower(), 0.5)
+    # Process each whitespace-separated word in the original sentence
+    for word, span_indices in tokenized["words"]:
+        # Use the most important word span inside this word, default to 0.5 if none was scored
+        scored = [word_importances[i] for i in span_indices if word_importances[i] is not None]
+        importance = max(scored) if scored else 0.5
         highlights.append({"word": word, "importance": str(round(importance, 2))})
     
     # Ensure we have highlights for all words
     if not highlights:
         # Fallback if no words were processed
-        for idx, (token, offset) in enumerate(zip(tokens, offsets)):
+        for offset in tokenized["offsets"]:
             if offset[0] == 0 and offset[1] == 0:
                 continue  # skip special tokens
             word = sentence[offset[0]:offset[1]]
@@ -169,8 +247,21 @@ def analyze_sentiment(request: SentimentRequest):
                 # Default importance of 0.5 for fallback
                 highlights.append({"word": word, "importance": str(0.5)})
     
-    return {"score": round(score, 2), "highlights": highlights}
+    return {"score": round(score, 2), "highlights": highlights, "exit_layer": exit_layer}
+
+@app.post("/analyze/", response_model=SentimentResponse)
+def analyze_sentiment(request: SentimentRequest):
+    tokenized = tokenize_batch([request.sentence])[0]
+    return analyze_tokenized(request.sentence, tokenized, request.early_exit, request.confidence_threshold)
+
+@app.post("/analyze_batch/", response_model=List[SentimentResponse])
+def analyze_sentiment_batch(request: BatchSentimentRequest):
+    tokenized = tokenize_batch(request.sentences)
+    return [
+        analyze_tokenized(sentence, entry, request.early_exit, request.confidence_threshold)
+        for sentence, entry in zip(request.sentences, tokenized)
+    ]
 
 @app.get("/")
 def root():
-    return {"message": "Sentiment Analysis API. Use /analyze/ endpoint with a sentence."}
\ No newline at end of file
+    return {"message": "Sentiment Analysis API. Use /analyze/ endpoint with a sentence, or /analyze_batch/ with a list of sentences."}
\ No newline at end of file
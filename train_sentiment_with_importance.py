@@ -7,6 +7,7 @@ import os
 import csv
 import time
 from typing import List, Dict
+from early_exit import EarlyExitHeads, distillation_loss, save_heads, HEADS_FILENAME
 
 # Configurations
 MODEL_NAME = "cardiffnlp/twitter-roberta-base-sentiment-latest"  # Replace with regression model if available
@@ -14,6 +15,7 @@ BATCH_SIZE = 8
 EPOCHS = 3
 LR = 2e-5
 MAX_LEN = 128
+EARLY_EXIT_LR = 1e-3
 
 # Example dataset class (supports CSV and JSONL)
 class ReviewDataset(Dataset):
@@ -55,7 +57,54 @@ class ReviewDataset(Dataset):
         return item
 
 
-def train(data_path, save_path):
+def train_early_exit(data_path, save_path, base_model):
+    # The encoder stays frozen: only the intermediate-layer heads are trained, by
+    # distilling the full-depth prediction of the model that will be served
+    tokenizer = AutoTokenizer.from_pretrained(base_model)
+    model = AutoModelForSequenceClassification.from_pretrained(base_model)
+    model.eval()
+    for param in model.parameters():
+        param.requires_grad = False
+    heads = EarlyExitHeads(model.config.num_hidden_layers, model.config.hidden_size, model.config.num_labels, base_model=base_model)
+    heads.train()
+    dataset = ReviewDataset(data_path, tokenizer, max_len=MAX_LEN)
+    loader = DataLoader(dataset, batch_size=BATCH_SIZE, shuffle=True)
+    optimizer = AdamW(heads.parameters(), lr=EARLY_EXIT_LR)
+    device = torch.device("mps" if torch.backends.mps.is_available() else ("cuda" if torch.cuda.is_available() else "cpu"))
+    print(device)
+    model.to(device)
+    heads.to(device)
+
+    for epoch in range(EPOCHS):
+        total_loss = 0.0
+        print(f"\nEpoch {epoch+1}/{EPOCHS} started...")
+        epoch_start_time = time.time()
+        for batch_idx, batch in enumerate(loader):
+            optimizer.zero_grad()
+            input_ids = batch["input_ids"].to(device)
+            attention_mask = batch["attention_mask"].to(device)
+            with torch.no_grad():
+                outputs = model(input_ids=input_ids, attention_mask=attention_mask, output_hidden_states=True)
+            loss = distillation_loss(outputs, heads)
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item()
+            if (batch_idx + 1) % 10 == 0 or (batch_idx + 1) == len(loader):
+                print(f"  Batch {batch_idx+1}/{len(loader)} | Current Loss: {loss.item():.4f}")
+        epoch_time = time.time() - epoch_start_time
+        mins, secs = divmod(epoch_time, 60)
+        print(f"Epoch {epoch+1}/{EPOCHS} | Distillation Loss: {total_loss/len(loader):.4f} | Time: {int(mins):02d}:{int(secs):02d}")
+    os.makedirs(save_path, exist_ok=True)
+    heads_path = os.path.join(save_path, HEADS_FILENAME)
+    save_heads(heads.cpu(), heads_path)
+    print(f"Early-exit heads saved to {heads_path}")
+
+
+def train(data_path, save_path, mode="full", base_model=None):
+    if mode == "early_exit":
+        if base_model is None:
+            raise ValueError("early_exit mode requires base_model: the fine-tuned model the API serves")
+        return train_early_exit(data_path, save_path, base_model)
     tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
     model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME, output_attentions=True)
     model.train()
@@ -109,5 +158,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--data", type=str, default="/content/data.jsonl", help="Path to training data (JSONL or CSV)")
     parser.add_argument("--save", type=str, default="/content/model_save", help="Path to save trained model")
+    parser.add_argument("--mode", type=str, default="full", choices=["full", "early_exit"], help="'full' fine-tunes the model, 'early_exit' trains intermediate-layer heads for a fine-tuned model")
+    parser.add_argument("--base", type=str, default=None, help="Fine-tuned model to train early-exit heads for (required in early_exit mode; must be the model the API serves)")
     args = parser.parse_args()
-    train(args.data, args.save)
\ No newline at end of file
+    if args.mode == "early_exit" and args.base is None:
+        parser.error("--base is required with --mode early_exit")
+    train(args.data, args.save, mode=args.mode, base_model=args.base)
\ No newline at end of file